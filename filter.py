@@ -5,164 +5,452 @@ import aiohttp
 import aiodns
 import time
 import os
+import pickle
 import random
-from typing import List, Tuple, Set
+import sys
+from collections import deque
+from typing import Dict, List, Optional, Tuple, Set
 
 class AsyncGroupedDomainResolver:
-    def __init__(self, dns_servers=None, timeout=3, concurrency_per_group=50, verbose=True):
+    def __init__(self, dns_servers=None, timeout=3, concurrency_per_group=50, verbose=True, global_concurrency=400,
+                 race_factor=2, cache_file=None):
         self.dns_servers = dns_servers or [
             '8.8.8.8', '1.1.1.1', '223.5.5.5', '119.29.29.29',
             '208.67.222.222', '9.9.9.9', '149.112.112.112', '8.8.4.4',
             '1.0.0.1', '223.6.6.6', "45.11.45.11", "4.2.2.2"
         ]
         self.timeout = timeout
+        # 单个 DNS 同时在途的查询数上限（A / AAAA 每条查询各占一个许可），
+        # 因此总在途查询数不超过 len(dns_servers) * concurrency_per_group
         self.concurrency_per_group = concurrency_per_group
+        # 解析 worker 数量，即同时在处理的域名数上限（不是查询数：重试的域名会竞速并同时查 A/AAAA，
+        # 一个域名最多占用 race_factor * 2 个查询）
+        self.global_concurrency = global_concurrency
+        # 重试时每个域名同时向多少个 DNS 发起查询，取最先成功的结果（<=1 表示不竞速）
+        self.race_factor = race_factor
+        # 重试看门狗: 最近 retry_watchdog_window 次重试的成功率低于 min_retry_success_rate 时停止重试
+        self.retry_watchdog_window = 500
+        self.min_retry_success_rate = 0.02
+        # 运行中每隔多少秒输出一次进度并保存检查点
+        self.progress_interval = 10
         self.verbose = verbose
+        # 域名 -> (过期时间戳, 是否解析成功)，重试时复用解析结果；
+        # 过期时间用 time.time() 而不是 monotonic，以便通过 cache_file 跨进程持久化
+        self._dns_cache: Dict[str, Tuple[float, bool]] = {}
+        self.cache_file = cache_file
+        self.cache_ttl_success = 3600
+        self.cache_ttl_nxdomain = 300
+        # 至少多少个不同 DNS 都回答"不存在"才认定域名无效：Quad9 等过滤型 DNS 会对拦截的域名返回 NXDOMAIN
+        self.nxdomain_quorum = 2
+        self._session: Optional[aiohttp.ClientSession] = None
+        # 每个 DNS 复用一个解析器（c-ares channel）及其并发信号量
+        self._resolvers: Dict[str, aiodns.DNSResolver] = {}
+        self._dns_semaphores: Dict[str, asyncio.Semaphore] = {}
+        # 每个 DNS 的统计: (成功数, 失败数, 累计耗时)，用于按表现分配域名
+        self._dns_stats: Dict[str, Tuple[int, int, float]] = {}
+        # 每个域名已经查询过的 DNS，重试时只分配给未尝试过的 DNS
+        self._per_domain_tried: Dict[str, Set[str]] = {}
+        # 每个域名回答过"不存在"的 DNS，达到 nxdomain_quorum 后才写入否定缓存
+        self._nxdomain_votes: Dict[str, Set[str]] = {}
+        self._retry_outcomes = deque(maxlen=self.retry_watchdog_window)
+        self._stop_retrying = False
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """复用同一个 HTTP 会话，避免每次请求重新握手"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=100, ttl_dns_cache=300, use_dns_cache=True)
+            )
+        return self._session
+
+    def _get_resolver(self, dns_server: str) -> aiodns.DNSResolver:
+        resolver = self._resolvers.get(dns_server)
+        if resolver is None:
+            resolver = aiodns.DNSResolver(nameservers=[dns_server], timeout=self.timeout, tries=1)
+            self._resolvers[dns_server] = resolver
+        return resolver
+
+    def _get_dns_semaphore(self, dns_server: str) -> asyncio.Semaphore:
+        semaphore = self._dns_semaphores.get(dns_server)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.concurrency_per_group)
+            self._dns_semaphores[dns_server] = semaphore
+        return semaphore
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+        for resolver in self._resolvers.values():
+            resolver.cancel()
+        self._resolvers.clear()
+        self._dns_semaphores.clear()
+
+    @staticmethod
+    def _parse_domains(text: str) -> List[str]:
+        """解析域名，跳过空行和注释行（# / !），保序去重"""
+        return list(dict.fromkeys(
+            line for line in map(str.strip, text.lower().splitlines())
+            if line and line[0] not in '#!'
+        ))
 
     async def fetch_domains(self, url: str) -> List[str]:
         """获取域名列表"""
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, timeout=30) as resp:
-                text = await resp.text()
-        domains = [line.strip().lower() for line in text.split("\n") 
-                  if line.strip() and not line.strip().startswith("#")]
+        session = await self._get_session()
+        async with session.get(url, timeout=30) as resp:
+            text = await resp.text()
+        return self._parse_domains(text)
+
+    async def _fetch_one_filter(self, session: aiohttp.ClientSession, url: str) -> Set[str]:
+        """获取单个过滤列表"""
+        if self.verbose:
+            print(f"🔍 正在获取过滤列表: {url}")
+        async with session.get(url, timeout=30) as resp:
+            text = await resp.text()
+
+        domains = set(self._parse_domains(text))
+
+        if self.verbose:
+            print(f"✅ 从 {url} 获取到 {len(domains)} 个过滤域名")
         return domains
 
     async def fetch_filter_domains(self, urls: List[str]) -> Set[str]:
-        """获取需要过滤的域名列表"""
+        """并发获取需要过滤的域名列表，单个列表失败不影响其它列表"""
+        session = await self._get_session()
+        results = await asyncio.gather(
+            *[self._fetch_one_filter(session, url) for url in urls],
+            return_exceptions=True
+        )
+
         filter_domains = set()
-        
-        async with aiohttp.ClientSession() as session:
-            for url in urls:
-                try:
-                    if self.verbose:
-                        print(f"🔍 正在获取过滤列表: {url}")
-                    async with session.get(url, timeout=30) as resp:
-                        text = await resp.text()
-                    
-                    # 解析域名，跳过注释行
-                    domains = [line.strip().lower() for line in text.split("\n") 
-                              if line.strip() and not line.strip().startswith("#")]
-                    filter_domains.update(domains)
-                    
-                    if self.verbose:
-                        print(f"✅ 从 {url} 获取到 {len(domains)} 个过滤域名")
-                        
-                except Exception as e:
-                    if self.verbose:
-                        print(f"⚠️ 获取过滤列表失败 {url}: {e}")
-                    
+        for url, result in zip(urls, results):
+            if isinstance(result, BaseException):
+                if self.verbose:
+                    print(f"⚠️ 获取过滤列表失败 {url}: {result}")
+                continue
+            filter_domains.update(result)
         return filter_domains
 
     def apply_filter(self, domains: List[str], filter_domains: Set[str]) -> Tuple[List[str], int]:
-        """应用过滤列表，移除需要过滤的域名"""
-        filtered_domains = [domain for domain in domains if domain not in filter_domains]
+        """应用过滤列表，移除需要过滤的域名（按后缀匹配，规则 a.com 同时命中 x.a.com）"""
+        # 规则中出现过的层级（点的个数），其它层级的后缀不可能命中，跳过切片和哈希查找
+        rule_depths = {rule.count('.') for rule in filter_domains}
+
+        def is_filtered(domain: str) -> bool:
+            depth = domain.count('.')
+            if depth in rule_depths and domain in filter_domains:
+                return True
+            pos = domain.find('.')
+            while pos != -1:
+                depth -= 1
+                if depth in rule_depths and domain[pos + 1:] in filter_domains:
+                    return True
+                pos = domain.find('.', pos + 1)
+            return False
+
+        filtered_domains = [domain for domain in domains if not is_filtered(domain)]
         filtered_count = len(domains) - len(filtered_domains)
         return filtered_domains, filtered_count
 
-    async def resolve_domain(self, domain: str, resolver: aiodns.DNSResolver) -> bool:
+    def _record_stats(self, dns_server: str, ok: bool, latency: float):
+        ok_count, fail_count, total_latency = self._dns_stats.get(dns_server, (0, 0, 0.0))
+        if ok:
+            ok_count += 1
+        else:
+            fail_count += 1
+        self._dns_stats[dns_server] = (ok_count, fail_count, total_latency + latency)
+
+    def _dns_weights(self) -> List[float]:
+        """按 成功率 / 平均耗时 计算各 DNS 的分配权重，无统计的 DNS 取已知平均耗时"""
+        latencies = [total / (ok + fail) for ok, fail, total in self._dns_stats.values() if ok + fail]
+        default_latency = sum(latencies) / len(latencies) if latencies else 1.0
+
+        weights = []
+        for dns in self.dns_servers:
+            ok, fail, total = self._dns_stats.get(dns, (0, 0, 0.0))
+            avg_latency = total / (ok + fail) if ok + fail else default_latency
+            weights.append((ok + 1) / (ok + fail + 2) / max(avg_latency, 0.01))
+        return weights
+
+    async def _query(self, resolver: aiodns.DNSResolver, domain: str, qtype: str,
+                     dns_server: str = None) -> Tuple[Optional[int], float]:
+        """查询一条记录，返回 (错误码, 耗时)，成功时错误码为 None
+
+        每条查询单独占用一个该 DNS 的许可，拿到许可后才记为已尝试并开始计时：
+        排队中被取消的竞速查询不算尝试，耗时也不含排队时间。
+        只处理 DNS 错误、超时和非法域名，CancelledError 等其它异常照常抛出。
+        """
+        async with self._get_dns_semaphore(dns_server):
+            if dns_server:
+                self._per_domain_tried.setdefault(domain, set()).add(dns_server)
+            start = time.monotonic()
+            try:
+                # 在 Python 侧再加一层超时，防止个别 c-ares 查询迟迟不返回
+                await asyncio.wait_for(resolver.query(domain, qtype), self.timeout)
+                code = None
+            except aiodns.error.DNSError as e:
+                code = e.args[0] if e.args else aiodns.error.ARES_ETIMEOUT
+            except asyncio.TimeoutError:
+                code = aiodns.error.ARES_ETIMEOUT
+            except ValueError:
+                # 无法做 IDNA 编码的域名由 pycares 同步抛出 IDNAError / UnicodeError
+                code = aiodns.error.ARES_EBADNAME
+            return code, time.monotonic() - start
+
+    def _load_cache(self):
+        """从 cache_file 加载上次运行的解析缓存，丢弃已过期的条目"""
+        if not self.cache_file or not os.path.exists(self.cache_file):
+            return
+        now = time.time()
         try:
-            await resolver.query(domain, 'A')
-            return True
-        except:
+            with open(self.cache_file, 'rb') as f:
+                cache = pickle.load(f)
+            # 格式不对（不是 域名 -> (过期时间戳, 是否成功) 的字典）时整个缓存作废
+            loaded = {}
+            for domain, (expiry, ok) in cache.items():
+                if not isinstance(domain, str) or not isinstance(expiry, (int, float)) or not isinstance(ok, bool):
+                    raise ValueError(f"无效的缓存条目: {domain!r}")
+                if expiry > now:
+                    loaded[domain] = (expiry, ok)
+        except Exception as e:
+            if self.verbose:
+                print(f"⚠️ 读取 DNS 缓存失败 {self.cache_file}: {e}", flush=True)
+            return
+
+        self._dns_cache.update(loaded)
+        if self.verbose:
+            print(f"♻️ 从 {self.cache_file} 加载 {len(loaded)} 条未过期的 DNS 缓存", flush=True)
+
+    def _save_cache(self):
+        """将未过期的解析缓存原子写入 cache_file"""
+        if not self.cache_file:
+            return
+        now = time.time()
+        cache = {domain: entry for domain, entry in self._dns_cache.items() if entry[0] > now}
+        os.makedirs(os.path.dirname(self.cache_file) or '.', exist_ok=True)
+        tmp_file = self.cache_file + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            pickle.dump(cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, self.cache_file)
+
+    def _cached_result(self, domain: str) -> Optional[bool]:
+        cached = self._dns_cache.get(domain)
+        if cached is not None and time.time() < cached[0]:
+            return cached[1]
+        return None
+
+    async def resolve_domain(self, domain: str, resolver: aiodns.DNSResolver, dns_server: str = None,
+                             probe_all: bool = False) -> bool:
+        """解析域名，probe_all 为 True 时并行查询 A 和 AAAA，任一成功即视为有效"""
+        cached = self._cached_result(domain)
+        if cached is not None:
+            return cached
+
+        if probe_all:
+            results = await asyncio.gather(
+                self._query(resolver, domain, 'A', dns_server),
+                self._query(resolver, domain, 'AAAA', dns_server)
+            )
+        else:
+            results = [await self._query(resolver, domain, 'A', dns_server)]
+        codes = [code for code, _ in results]
+        latency = max(elapsed for _, elapsed in results)
+
+        ok = None in codes
+        bad_name = aiodns.error.ARES_EBADNAME in codes
+        # 非法域名与 DNS 无关，不计入统计；NXDOMAIN 可能是过滤型 DNS 的拦截，按失败计，不奖励这类 DNS
+        if dns_server and not bad_name:
+            self._record_stats(dns_server, ok, latency)
+
+        # 缓存成功结果和非法域名；超时等错误留给换 DNS 重试。
+        # "不存在"要有 nxdomain_quorum 个 DNS 一致才缓存（缓存按域名生效，会挡住其它 DNS）；
+        # 只查了 A 的 NODATA 不算，重试时还要再查 AAAA
+        if ok:
+            self._dns_cache[domain] = (time.time() + self.cache_ttl_success, True)
+        elif bad_name:
+            self._dns_cache[domain] = (time.time() + self.cache_ttl_nxdomain, False)
+        elif (dns_server
+              and all(code in (aiodns.error.ARES_ENOTFOUND, aiodns.error.ARES_ENODATA) for code in codes)
+              and (probe_all or aiodns.error.ARES_ENOTFOUND in codes)):
+            votes = self._nxdomain_votes.setdefault(domain, set())
+            votes.add(dns_server)
+            if len(votes) >= self.nxdomain_quorum:
+                self._dns_cache[domain] = (time.time() + self.cache_ttl_nxdomain, False)
+        return ok
+
+    async def resolve_domain_race(self, domain: str, dns_servers: List[str], probe_all: bool = False) -> bool:
+        """同时向多个 DNS 查询同一域名，任一成功即返回并取消其余查询"""
+        pending = {
+            asyncio.create_task(self.resolve_domain(domain, self._get_resolver(dns), dns, probe_all))
+            for dns in dns_servers
+        }
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                if any(task.result() for task in done):
+                    return True
             return False
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def _pick_dns(self, domain: str, weights: List[float], exclude=()) -> Optional[str]:
+        """按权重在该域名尚未尝试过（且不在 exclude 中）的 DNS 中随机选一个，没有可选的返回 None"""
+        tried = self._per_domain_tried.get(domain)
+        if not tried and not exclude:
+            return random.choices(self.dns_servers, weights=weights)[0]
+        candidates = [
+            i for i, dns in enumerate(self.dns_servers)
+            if dns not in exclude and (not tried or dns not in tried)
+        ]
+        if not candidates:
+            return None
+        return self.dns_servers[random.choices(candidates, weights=[weights[i] for i in candidates])[0]]
+
+    def _record_retry(self, ok: bool):
+        """重试看门狗：窗口内的重试成功率过低时停止继续重试"""
+        self._retry_outcomes.append(ok)
+        if len(self._retry_outcomes) == self._retry_outcomes.maxlen:
+            success_rate = sum(self._retry_outcomes) / len(self._retry_outcomes)
+            if success_rate < self.min_retry_success_rate and not self._stop_retrying:
+                self._stop_retrying = True
+                if self.verbose:
+                    print(f"⚠️ 最近 {len(self._retry_outcomes)} 次重试成功率 {success_rate * 100:.2f}%，"
+                          f"低于阈值 {self.min_retry_success_rate * 100:.2f}%，停止重试。", flush=True)
+
+    async def _resolve_worker(self, queue: asyncio.Queue, max_tries: int, valid: List[str], failed: List[str]):
+        """从队列取出 (域名, 第几次尝试) 解析，失败且未达上限则换一个未尝试过的 DNS 重新入队
+
+        首次尝试只向一个 DNS 查 A；重试的都是难解析的域名，改为多 DNS 竞速并同时查 A/AAAA。
+        """
+        while True:
+            domain, attempt = await queue.get()
+            try:
+                retry = attempt > 1
+                if retry and self._stop_retrying:
+                    failed.append(domain)
+                    continue
 
-    async def resolve_group(self, domains: List[str], dns_server: str) -> Tuple[List[str], List[str]]:
-        """解析单个 DNS 下的一组域名"""
-        valid, failed = [], []
-        semaphore = asyncio.Semaphore(self.concurrency_per_group)
-        resolver = aiodns.DNSResolver(nameservers=[dns_server], timeout=self.timeout)
+                # 每个域名都按最新统计计算权重（只有十几个 DNS，开销可以忽略）
+                weights = self._dns_weights()
+                dns_server = self._pick_dns(domain, weights)
+                if dns_server is None:
+                    failed.append(domain)
+                    continue
+
+                if retry and self.race_factor > 1:
+                    # 竞速的其它 DNS 同样按权重挑选，优先快而稳的 DNS
+                    servers = [dns_server]
+                    while len(servers) < self.race_factor:
+                        peer = self._pick_dns(domain, weights, exclude=servers)
+                        if peer is None:
+                            break
+                        servers.append(peer)
+                    ok = await self.resolve_domain_race(domain, servers, probe_all=True)
+                else:
+                    ok = await self.resolve_domain(domain, self._get_resolver(dns_server), dns_server, probe_all=retry)
 
-        async def worker(domain):
-            async with semaphore:
-                if await self.resolve_domain(domain, resolver):
+                if retry:
+                    self._record_retry(ok)
+                if ok:
                     valid.append(domain)
+                elif attempt < max_tries and self._cached_result(domain) is None:
+                    # 已有多个 DNS 确认不存在（或非法）的域名换 DNS 也没有意义，不再重试
+                    queue.put_nowait((domain, attempt + 1))
                 else:
                     failed.append(domain)
+            finally:
+                queue.task_done()
+
+    async def _report_progress(self, total: int, valid: List[str], failed: List[str], output_success: str,
+                               stop: asyncio.Event):
+        """定期输出进度，并在线程中保存检查点，写盘与解析并行
+
+        通过 stop 通知退出而不是直接 cancel：取消 to_thread 不会停止已在写盘的线程，
+        必须等检查点写完再做最终保存，避免两次写入同时落到 output_success。
+        """
+        while True:
+            try:
+                await asyncio.wait_for(stop.wait(), self.progress_interval)
+                return
+            except asyncio.TimeoutError:
+                pass
+            if self.verbose:
+                done = len(valid) + len(failed)
+                sys.stdout.write(f"⏳ 进度: 已完成 {done}/{total}, 成功 {len(valid)}, 失败 {len(failed)}\n")
+                sys.stdout.flush()
+            await asyncio.to_thread(self.save_domains, valid.copy(), output_success)
 
-        await asyncio.gather(*[worker(d) for d in domains])
-        return valid, failed
+    async def batch_resolve(self, domains: List[str], output_success: str, output_failed: str = None, max_tries: int = 5):
+        """用一个常驻 worker 池解析全部域名，失败的域名在池内换 DNS 重新入队，没有轮次屏障"""
+        start_time = time.time()
+        valid, failed = [], []
+        self._load_cache()
+        self._retry_outcomes = deque(maxlen=self.retry_watchdog_window)
+        self._stop_retrying = False
 
-    async def resolve_in_round(self, domains: List[str], round_num: int) -> Tuple[List[str], List[str]]:
-        """一次性尝试所有 DNS，每轮随机分配域名到 DNS"""
         if self.verbose:
-            print(f"\n🚀 第 {round_num} 轮解析: {len(domains)} 个域名, 使用 {len(self.dns_servers)} 个DNS", flush=True)
-
-        # 随机打乱域名列表
-        domains_shuffled = domains[:]
-        random.shuffle(domains_shuffled)
+            print(f"\n🚀 开始解析: {len(domains)} 个域名, 使用 {len(self.dns_servers)} 个DNS, "
+                  f"每个域名最多尝试 {max_tries} 次", flush=True)
 
-        # 随机分配到 DNS
-        domain_groups = [[] for _ in self.dns_servers]
-        for domain in domains_shuffled:
-            dns_index = random.randint(0, len(self.dns_servers) - 1)
-            domain_groups[dns_index].append(domain)
+        queue = asyncio.Queue()
+        for domain in domains:
+            queue.put_nowait((domain, 1))
 
-        tasks = [
-            self.resolve_group(group, dns)
-            for group, dns in zip(domain_groups, self.dns_servers) if group
+        workers = [
+            asyncio.create_task(self._resolve_worker(queue, max_tries, valid, failed))
+            for _ in range(min(self.global_concurrency, len(domains)) or 1)
         ]
-        results = await asyncio.gather(*tasks)
-
-        all_valid, all_failed = [], []
-        for valid, failed in results:
-            all_valid.extend(valid)
-            all_failed.extend(failed)
-
-        if self.verbose:
-            success_rate = (len(all_valid) / len(domains)) * 100 if domains else 0
-            print(f"✅ 第 {round_num} 轮完成: 成功 {len(all_valid)}, 失败 {len(all_failed)}, 成功率 {success_rate:.2f}%", flush=True)
-
-        return all_valid, all_failed
-
-    async def batch_resolve(self, domains: List[str], output_success: str, output_failed: str = None, max_rounds: int = 5):
-        start_time = time.time()
-        remaining_domains = domains[:]
-        all_valid = []
-        round_num = 1
-
-        while remaining_domains and round_num <= max_rounds:
-            valid, failed = await self.resolve_in_round(remaining_domains, round_num)
-            all_valid.extend(valid)
-            remaining_domains = failed
-
-            min_success_count = 10  # 阈值
-            if len(valid) < min_success_count:
-                if self.verbose:
-                    print(f"⚠️ 第 {round_num} 轮成功 {len(valid)} 个域名，低于阈值 {min_success_count}，任务终止。", flush=True)
-                break
-
-            round_num += 1
-
-        # 检查是否因为达到最大轮数而终止
-        if round_num > max_rounds and remaining_domains:
-            if self.verbose:
-                print(f"⏹️ 已完成 {max_rounds} 轮解析，达到最大轮数限制，任务终止。", flush=True)
+        stop_reporter = asyncio.Event()
+        reporter = asyncio.create_task(self._report_progress(len(domains), valid, failed, output_success, stop_reporter))
+        join_task = asyncio.create_task(queue.join())
+        try:
+            # worker 异常退出时不再等待队列清空，直接抛出
+            await asyncio.wait([join_task, *workers], return_when=asyncio.FIRST_COMPLETED)
+            for worker in workers:
+                if worker.done():
+                    worker.result()
+        finally:
+            for task in (join_task, *workers):
+                task.cancel()
+            # 等正在进行的检查点写完，再开始最终保存
+            stop_reporter.set()
+            await asyncio.gather(join_task, reporter, *workers, return_exceptions=True)
 
         total_elapsed = time.time() - start_time
-        final_success_rate = (len(all_valid) / len(domains)) * 100 if domains else 0
+        final_success_rate = (len(valid) / len(domains)) * 100 if domains else 0
 
-        self.save_domains(all_valid, output_success)
+        await asyncio.to_thread(self.save_domains, valid, output_success)
         if output_failed:
-            self.save_domains(remaining_domains, output_failed)
+            await asyncio.to_thread(self.save_domains, failed, output_failed)
+        await asyncio.to_thread(self._save_cache)
 
         if self.verbose:
-            print("\n🎯 任务完成!", flush=True)
-            print(f"📊 总域名数: {len(domains)}", flush=True)
-            print(f"✅ 有效域名: {len(all_valid)}", flush=True)
-            print(f"❌ 最终失败: {len(remaining_domains)}", flush=True)
-            print(f"📈 成功率: {final_success_rate:.2f}%", flush=True)
-            print(f"🔄 执行轮数: {round_num-1}/{max_rounds}", flush=True)
-            print(f"⏱ 总耗时: {total_elapsed:.1f}s", flush=True)
-            print(f"💾 成功结果: {output_success}", flush=True)
+            # 汇总信息一次写出、一次 flush
+            summary = (
+                f"\n🎯 任务完成!\n"
+                f"📊 总域名数: {len(domains)}\n"
+                f"✅ 有效域名: {len(valid)}\n"
+                f"❌ 最终失败: {len(failed)}\n"
+                f"📈 成功率: {final_success_rate:.2f}%\n"
+                f"⏱ 总耗时: {total_elapsed:.1f}s\n"
+                f"💾 成功结果: {output_success}\n"
+            )
             if output_failed:
-                print(f"💾 失败结果: {output_failed}", flush=True)
+                summary += f"💾 失败结果: {output_failed}\n"
+            sys.stdout.write(summary)
+            sys.stdout.flush()
 
     def save_domains(self, domains: List[str], filename: str):
+        """先写临时文件再 os.replace，写到一半被中断也不会留下截断的结果文件"""
         os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
-        with open(filename, 'w', encoding='utf-8') as f:
-            for d in domains:
-                f.write(d + "\n")
+        tmp_file = filename + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8', buffering=1024 * 1024) as f:
+            f.write("\n".join(domains))
+            if domains:
+                f.write("\n")
+        os.replace(tmp_file, filename)
 
 
 async def main():
@@ -172,29 +460,42 @@ async def main():
         "https://raw.githubusercontent.com/privacy-protection-tools/dead-horse/master/anti-ad-white-list.txt"
     ]
     OUTPUT_SUCCESS = "./output/valid_domains.txt"
+    DNS_CACHE_FILE = "./output/.dns_cache.pickle"
 
-    resolver = AsyncGroupedDomainResolver(timeout=3, concurrency_per_group=20, verbose=True)
+    # 12 个 DNS * 每个 20 个在途查询 = 最多 240 个在途查询；worker 数与之相同，
+    # 重试时一个域名会占用多个查询，超出的查询在对应 DNS 的信号量上排队
+    resolver = AsyncGroupedDomainResolver(timeout=3, concurrency_per_group=20, global_concurrency=240,
+                                          verbose=True, cache_file=DNS_CACHE_FILE)
     
-    print("🔍 正在获取域名列表...", flush=True)
-    domains = await resolver.fetch_domains(SOURCE_URL)
-    print(f"📦 获取到 {len(domains)} 个原始域名", flush=True)
+    try:
+        print("🔍 正在获取域名列表...", flush=True)
+        domains = await resolver.fetch_domains(SOURCE_URL)
+        print(f"📦 获取到 {len(domains)} 个原始域名", flush=True)
 
-    print("\n🚫 正在获取过滤列表...", flush=True)
-    filter_domains = await resolver.fetch_filter_domains(FILTER_URLS)
-    print(f"🛡️ 获取到 {len(filter_domains)} 个过滤域名", flush=True)
+        print("\n🚫 正在获取过滤列表...", flush=True)
+        filter_domains = await resolver.fetch_filter_domains(FILTER_URLS)
+        print(f"🛡️ 获取到 {len(filter_domains)} 个过滤域名", flush=True)
 
-    print("\n🔧 正在应用过滤规则...", flush=True)
-    filtered_domains, filtered_count = resolver.apply_filter(domains, filter_domains)
-    print(f"✂️ 已过滤 {filtered_count} 个域名", flush=True)
-    print(f"📝 剩余待解析域名: {len(filtered_domains)} 个", flush=True)
+        print("\n🔧 正在应用过滤规则...", flush=True)
+        filtered_domains, filtered_count = resolver.apply_filter(domains, filter_domains)
+        print(f"✂️ 已过滤 {filtered_count} 个域名", flush=True)
+        print(f"📝 剩余待解析域名: {len(filtered_domains)} 个", flush=True)
 
-    if not filtered_domains:
-        print("⚠️ 所有域名都被过滤，无需进行解析", flush=True)
-        return
+        if not filtered_domains:
+            print("⚠️ 所有域名都被过滤，无需进行解析", flush=True)
+            return
 
-    # 最多解析5轮，不保存失败的域名
-    await resolver.batch_resolve(filtered_domains, OUTPUT_SUCCESS, None, max_rounds=5)
+        # 每个域名最多尝试5次，不保存失败的域名
+        await resolver.batch_resolve(filtered_domains, OUTPUT_SUCCESS, None, max_tries=5)
+    finally:
+        await resolver.close()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    try:
+        import uvloop
+    except ImportError:
+        # 未安装 uvloop（如 Windows）时使用标准事件循环
+        asyncio.run(main())
+    else:
+        uvloop.run(main())